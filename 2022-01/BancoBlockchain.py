@@ -7,8 +7,28 @@
 
 import hashlib
 import json
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from time import time, ctime
-from pymongo import MongoClient
+from pymongo import MongoClient, WriteConcern
+
+# Referência direta ao construtor, evitando a busca do atributo no módulo hashlib a cada hash
+_sha256 = hashlib.sha256
+
+# Numba é opcional: sem ele a Prova de Trabalho roda apenas com o hashlib
+try:
+    import numpy as np
+    from numba import get_num_threads, njit, prange
+except ImportError:
+    njit = None
+
+# BLAKE3 é opcional e só é usado quando pedido em HashAlgorithm
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 max_nonce = 2 ** 32
 init_reward = 50
@@ -16,14 +36,295 @@ block_reward_rate = 1000
 difficulty_bits_block_rate = 100
 difficulty_block_rate = 100
 
+# A partir de quantos bits de dificuldade vale a pena usar o kernel compilado.
+# Num único núcleo ele é tão rápido quanto o laço em hashlib (~6 milhões de hashes/s),
+# então o ganho vem só de dividir a busca entre núcleos, e a primeira chamada sem cache
+# custa ~5 s de compilação. Com 24 bits cada bloco leva ~3 s em hashlib, então
+# a compilação se paga em poucos blocos com dois ou mais núcleos
+pow_kernel_min_bits = 24
+# Quantidade de nonces testados por fatia em cada thread do kernel
+pow_kernel_slice = 2 ** 14
+# A partir de quantos nós um nível da árvore de Merkle é dividido entre processos
+merkle_parallel_min_leaves = 2 ** 14
+# A partir de quantas folhas a árvore de Merkle vale a compilação do kernel Numba.
+# Sem cache a primeira chamada custa ~11 s, enquanto o hashlib faz ~3 milhões de pares/s:
+# só uma árvore dessa ordem (~5 s em série) justifica compilar. Com CompiledMerkle=True
+# (cache em disco já aquecido ou sessão longa) o kernel é usado já a partir de merkle_parallel_min_leaves
+merkle_kernel_min_leaves = 2 ** 24
+
+
+def _hash_merkle_pairs(level_chunk):
+    """
+    Faça o hash de cada par de digests consecutivos de um trecho de um nível da árvore de Merkle.
+    Cada par já é contíguo no buffer, então é lido por memoryview sem cópia nem concatenação.
+    :param level_chunk: Bytes com um número par de digests de 32 bytes
+    :return: Bytearray com os digests dos pares
+    """
+    view = memoryview(level_chunk)
+    return bytearray().join([_sha256(view[i:i + 64]).digest() for i in range(0, len(view), 64)])
+
+
+if njit is not None:
+    _SHA256_K = np.array([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+    ], dtype=np.int64)
+
+    _SHA256_IV = np.array([
+        0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+    ], dtype=np.int64)
+
+    @njit(nogil=True, cache=True)
+    def _rotr(x, n):
+        return ((x >> n) | (x << (32 - n))) & 0xFFFFFFFF
+
+    @njit(nogil=True, cache=True)
+    def _sha256_schedule(block, w):
+        """
+        Expande um bloco de 64 bytes na agenda de mensagens (W) do SHA-256.
+        :param block: Bloco de 64 bytes (uint8)
+        :param w: Área de trabalho de 64 palavras (int64), preenchida no lugar
+        """
+        for t in range(16):
+            w[t] = ((np.int64(block[4 * t]) << 24) | (np.int64(block[4 * t + 1]) << 16)
+                    | (np.int64(block[4 * t + 2]) << 8) | np.int64(block[4 * t + 3]))
+        for t in range(16, 64):
+            s0 = _rotr(w[t - 15], 7) ^ _rotr(w[t - 15], 18) ^ (w[t - 15] >> 3)
+            s1 = _rotr(w[t - 2], 17) ^ _rotr(w[t - 2], 19) ^ (w[t - 2] >> 10)
+            w[t] = (w[t - 16] + s0 + w[t - 7] + s1) & 0xFFFFFFFF
+
+    @njit(nogil=True, cache=True)
+    def _sha256_rounds(state, w):
+        """
+        Aplica as 64 rodadas do SHA-256 sobre uma agenda de mensagens já expandida.
+        :param state: Estado de 8 palavras (int64), atualizado no lugar
+        :param w: Agenda de mensagens de 64 palavras (int64)
+        """
+        a, b, c, d = state[0], state[1], state[2], state[3]
+        e, f, g, h = state[4], state[5], state[6], state[7]
+        for t in range(64):
+            s1 = _rotr(e, 6) ^ _rotr(e, 11) ^ _rotr(e, 25)
+            ch = (e & f) ^ ((~e) & g)
+            t1 = (h + s1 + ch + _SHA256_K[t] + w[t]) & 0xFFFFFFFF
+            s0 = _rotr(a, 2) ^ _rotr(a, 13) ^ _rotr(a, 22)
+            maj = (a & b) ^ (a & c) ^ (b & c)
+            t2 = (s0 + maj) & 0xFFFFFFFF
+            h, g, f, e = g, f, e, (d + t1) & 0xFFFFFFFF
+            d, c, b, a = c, b, a, (t1 + t2) & 0xFFFFFFFF
+
+        state[0] = (state[0] + a) & 0xFFFFFFFF
+        state[1] = (state[1] + b) & 0xFFFFFFFF
+        state[2] = (state[2] + c) & 0xFFFFFFFF
+        state[3] = (state[3] + d) & 0xFFFFFFFF
+        state[4] = (state[4] + e) & 0xFFFFFFFF
+        state[5] = (state[5] + f) & 0xFFFFFFFF
+        state[6] = (state[6] + g) & 0xFFFFFFFF
+        state[7] = (state[7] + h) & 0xFFFFFFFF
+
+    @njit(nogil=True, cache=True)
+    def _sha256_compress(state, block, w):
+        """
+        Aplica a função de compressão do SHA-256 a um bloco de 64 bytes.
+        :param state: Estado de 8 palavras (int64), atualizado no lugar
+        :param block: Bloco de 64 bytes (uint8)
+        :param w: Área de trabalho de 64 palavras (int64)
+        """
+        _sha256_schedule(block, w)
+        _sha256_rounds(state, w)
+
+    def _sha256_pad64_schedule():
+        """
+        Expanda a agenda de mensagens do bloco de padding de uma mensagem de exatamente 64 bytes
+        (0x80, zeros e o tamanho de 512 bits). Ela é constante, então é calculada uma única vez.
+        :return: Array de 64 palavras (int64)
+        """
+        def rotr(x, n):
+            return ((x >> n) | (x << (32 - n))) & 0xFFFFFFFF
+
+        w = [0x80000000] + [0] * 14 + [512]
+        for t in range(16, 64):
+            s0 = rotr(w[t - 15], 7) ^ rotr(w[t - 15], 18) ^ (w[t - 15] >> 3)
+            s1 = rotr(w[t - 2], 17) ^ rotr(w[t - 2], 19) ^ (w[t - 2] >> 10)
+            w.append((w[t - 16] + s0 + w[t - 7] + s1) & 0xFFFFFFFF)
+        return np.array(w, dtype=np.int64)
+
+    _SHA256_PAD64_W = _sha256_pad64_schedule()
+
+    # Quantos pares de um nível da árvore de Merkle são processados juntos, intercalados,
+    # para que o compilador use as instruções SIMD em todas as mensagens ao mesmo tempo
+    _MERKLE_LANES = 16
+    _SHA256_PAD64_W_LANES = np.repeat(_SHA256_PAD64_W.reshape(64, 1), _MERKLE_LANES, axis=1)
+
+    @njit(nogil=True, cache=True)
+    def _sha256_rounds_lanes(state, w):
+        """
+        Aplica as 64 rodadas do SHA-256 a várias mensagens intercaladas (uma por coluna).
+        :param state: Estados de 8 palavras por mensagem, shape (8, n) (int64), atualizados no lugar
+        :param w: Agendas de mensagens, shape (64, n) ou mais colunas (int64)
+        """
+        a, b, c, d = state[0].copy(), state[1].copy(), state[2].copy(), state[3].copy()
+        e, f, g, h = state[4].copy(), state[5].copy(), state[6].copy(), state[7].copy()
+        for t in range(64):
+            for lane in range(state.shape[1]):
+                s1 = _rotr(e[lane], 6) ^ _rotr(e[lane], 11) ^ _rotr(e[lane], 25)
+                ch = (e[lane] & f[lane]) ^ ((~e[lane]) & g[lane])
+                t1 = (h[lane] + s1 + ch + _SHA256_K[t] + w[t, lane]) & 0xFFFFFFFF
+                s0 = _rotr(a[lane], 2) ^ _rotr(a[lane], 13) ^ _rotr(a[lane], 22)
+                maj = (a[lane] & b[lane]) ^ (a[lane] & c[lane]) ^ (b[lane] & c[lane])
+                t2 = (s0 + maj) & 0xFFFFFFFF
+                h[lane], g[lane], f[lane], e[lane] = g[lane], f[lane], e[lane], (d[lane] + t1) & 0xFFFFFFFF
+                d[lane], c[lane], b[lane], a[lane] = c[lane], b[lane], a[lane], (t1 + t2) & 0xFFFFFFFF
+
+        state[0] = (state[0] + a) & 0xFFFFFFFF
+        state[1] = (state[1] + b) & 0xFFFFFFFF
+        state[2] = (state[2] + c) & 0xFFFFFFFF
+        state[3] = (state[3] + d) & 0xFFFFFFFF
+        state[4] = (state[4] + e) & 0xFFFFFFFF
+        state[5] = (state[5] + f) & 0xFFFFFFFF
+        state[6] = (state[6] + g) & 0xFFFFFFFF
+        state[7] = (state[7] + h) & 0xFFFFFFFF
+
+    @njit(nogil=True, parallel=True, cache=True)
+    def _hash_merkle_pairs_d64(level, next_level):
+        """
+        Faça o hash SHA-256 de cada par (64 bytes) de um nível da árvore de Merkle.
+        Os pares são processados em grupos de _MERKLE_LANES mensagens intercaladas e os grupos
+        são distribuídos entre os núcleos. Como toda entrada tem 64 bytes, o segundo bloco
+        (padding) tem agenda constante e só as rodadas são executadas para ele.
+        :param level: Nível com um número par de digests de 32 bytes (uint8)
+        :param next_level: Saída com um digest de 32 bytes por par (uint8)
+        """
+        n_pairs = level.shape[0] // 64
+        n_groups = (n_pairs + _MERKLE_LANES - 1) // _MERKLE_LANES
+        for group in prange(n_groups):
+            first = group * _MERKLE_LANES
+            lanes = min(_MERKLE_LANES, n_pairs - first)
+            state = np.empty((8, lanes), np.int64)
+            w = np.empty((64, lanes), np.int64)
+
+            # Carrega os pares do grupo, uma mensagem por coluna
+            for lane in range(lanes):
+                offset = (first + lane) * 64
+                for i in range(8):
+                    state[i, lane] = _SHA256_IV[i]
+                for t in range(16):
+                    w[t, lane] = ((np.int64(level[offset + 4 * t]) << 24) | (np.int64(level[offset + 4 * t + 1]) << 16)
+                                  | (np.int64(level[offset + 4 * t + 2]) << 8) | np.int64(level[offset + 4 * t + 3]))
+            for t in range(16, 64):
+                for lane in range(lanes):
+                    s0 = _rotr(w[t - 15, lane], 7) ^ _rotr(w[t - 15, lane], 18) ^ (w[t - 15, lane] >> 3)
+                    s1 = _rotr(w[t - 2, lane], 17) ^ _rotr(w[t - 2, lane], 19) ^ (w[t - 2, lane] >> 10)
+                    w[t, lane] = (w[t - 16, lane] + s0 + w[t - 7, lane] + s1) & 0xFFFFFFFF
+
+            _sha256_rounds_lanes(state, w)
+            _sha256_rounds_lanes(state, _SHA256_PAD64_W_LANES)
+
+            for lane in range(lanes):
+                offset = (first + lane) * 32
+                for i in range(8):
+                    next_level[offset + 4 * i] = (state[i, lane] >> 24) & 0xFF
+                    next_level[offset + 4 * i + 1] = (state[i, lane] >> 16) & 0xFF
+                    next_level[offset + 4 * i + 2] = (state[i, lane] >> 8) & 0xFF
+                    next_level[offset + 4 * i + 3] = state[i, lane] & 0xFF
+
+    @njit(nogil=True, cache=True)
+    def _pow_search_range(midstate, tail, prefix_length, zero_words, mask, start, end):
+        """
+        Procura sequencialmente o primeiro nonce em [start, end) cujo hash fica abaixo do alvo.
+        Como o alvo é 2 ** (256 - bits), isso equivale aos primeiros bits do digest serem zero.
+        :param midstate: Estado do SHA-256 após os blocos completos do prefixo
+        :param tail: Bytes restantes do prefixo (menos de 64)
+        :param prefix_length: Tamanho total do prefixo em bytes
+        :param zero_words: Quantas palavras de 32 bits iniciais do digest precisam ser zero
+        :param mask: Bits da palavra seguinte que também precisam ser zero
+        :return: Nonce encontrado ou -1
+        """
+        # Monta os blocos finais: resto do prefixo, nonce, padding e tamanho da mensagem
+        n_tail = tail.shape[0]
+        n_bytes = 64 if n_tail + 4 + 9 <= 64 else 128
+        buf = np.zeros(n_bytes, np.uint8)
+        buf[:n_tail] = tail
+        buf[n_tail + 4] = 0x80
+        bit_length = (prefix_length + 4) * 8
+        for i in range(8):
+            buf[n_bytes - 1 - i] = (bit_length >> (8 * i)) & 0xFF
+
+        state = np.empty(8, np.int64)
+        w = np.empty(64, np.int64)
+        for nonce in range(start, end):
+            buf[n_tail] = nonce & 0xFF
+            buf[n_tail + 1] = (nonce >> 8) & 0xFF
+            buf[n_tail + 2] = (nonce >> 16) & 0xFF
+            buf[n_tail + 3] = (nonce >> 24) & 0xFF
+
+            state[:] = midstate
+            _sha256_compress(state, buf[0:64], w)
+            if n_bytes == 128:
+                _sha256_compress(state, buf[64:128], w)
+
+            # As palavras do estado já são o digest em big-endian: testa direto os bits
+            # que precisam ser zero, sem serializar o digest em bytes.
+            # Quase todo nonce é descartado já na primeira palavra
+            for i in range(zero_words):
+                if state[i] != 0:
+                    break
+            else:
+                if zero_words == 8 or state[zero_words] & mask == 0:
+                    return nonce
+        return -1
+
+    @njit(nogil=True, parallel=True, cache=True)
+    def _pow_search(midstate, tail, prefix_length, zero_words, mask, start, end, n_slices):
+        """
+        Divide [start, end) em fatias processadas em paralelo e retorna o menor nonce válido.
+        :return: Nonce encontrado ou -1
+        """
+        size = (end - start + n_slices - 1) // n_slices
+        found = np.full(n_slices, -1, np.int64)
+        for i in prange(n_slices):
+            lo = start + i * size
+            hi = min(lo + size, end)
+            if lo < hi:
+                found[i] = _pow_search_range(midstate, tail, prefix_length, zero_words, mask, lo, hi)
+
+        # As fatias estão em ordem, então a primeira com resultado tem o menor nonce
+        for i in range(n_slices):
+            if found[i] >= 0:
+                return found[i]
+        return -1
+
 class IoTBlockchainDB(object):
     def __init__(self, 
                  MongoIP:str='127.0.0.1', 
                  MongoPort:int=27017,
+                 BatchSize:int=1,
+                 HashAlgorithm:str='sha256',
+                 CompiledMerkle:bool=False,
                 ):
         """
         Inicializando Blockchain
-        """
+        :param BatchSize: Quantos blocos acumular em memória antes de gravá-los de uma vez no banco.
+            Com BatchSize > 1, chame close() ao terminar para gravar os blocos ainda pendentes
+        :param HashAlgorithm: 'sha256' ou 'blake3', usado nos ids das transações e nos nós da árvore de Merkle.
+            Deve ser o mesmo durante toda a vida da cadeia; a Prova de Trabalho e o hash dos blocos usam sempre SHA-256
+        :param CompiledMerkle: Usa o kernel Numba em todos os níveis largos da árvore de Merkle, aceitando
+            o custo da compilação na primeira chamada; sem isso ele só é usado a partir de merkle_kernel_min_leaves
+        """
+        if HashAlgorithm == 'sha256':
+            self._node_hash = _sha256
+        elif HashAlgorithm == 'blake3':
+            if blake3 is None:
+                raise ImportError("HashAlgorithm='blake3' requer o pacote blake3 (pip install blake3)")
+            self._node_hash = blake3.blake3
+        else:
+            raise ValueError(f'HashAlgorithm desconhecido: {HashAlgorithm}')
+
         # Definindo cliente do MongoDB
         self.client = MongoClient(f'mongodb://{MongoIP}:{MongoPort}')
 
@@ -32,20 +333,88 @@ class IoTBlockchainDB(object):
 
         # Criando coleção de documentos 'block'
         self.blocks = self.db.blocks
+        self.create_indexes()
+
+        # Blocos gerados e ainda não gravados; são enviados em lote por flush(),
+        # sem esperar o journal do MongoDB
+        self.batch_size = BatchSize
+        self._pending_blocks = []
+        self._bulk_blocks = self.blocks.with_options(write_concern=WriteConcern(j=False))
 
         # Salva todas as transações na memória,
         # só grava no banco de dados quando o minerador minera com sucesso um novo bloco
-        self.transactions = []
+        self._reset_transactions()
 
         # Redefine o tempo decorrido e o hash_power para 0
         self.elapsed_time = 0   # segundos
         self.hash_power = 0     # hashes por segundo
 
+        # Pool de processos para os níveis largos da árvore de Merkle, criado sob demanda
+        self._merkle_pool = None
+        self.compiled_merkle = CompiledMerkle
+
+        # Mantém em memória o último bloco e o comprimento da cadeia,
+        # evitando consultas ao MongoDB a cada bloco gerado
+        self._load_chain_tip()
+
+    def create_indexes(self):
+        """
+        Crie os índices da coleção de blocos (operação idempotente).
+        A altura identifica o bloco; os demais campos são usados para ordenar em get_top_blocks.
+        """
+        self.blocks.create_index([('height', 1)], unique=True)
+        for field in ('difficulty', 'elapsed_time', 'block_reward', 'hash_power', 'nonce', 'number_of_transaction'):
+            self.blocks.create_index([(field, -1)])
+
+    def _load_chain_tip(self):
+        """
+        Carregue do banco de dados o cabeçalho do último bloco e o comprimento da cadeia para o cache em memória.
+        O bloco completo, com as transações, só é buscado quando for preciso fazer o hash dele.
+        """
+        self._length = self.get_length()
+        self._last_header = self._get_last_header()
+        self._last_block = None
+        self._last_digest = None
+
+    def _get_last_header(self):
+        """
+        Busque apenas os campos do último bloco usados nos cálculos de recompensa e dificuldade.
+        :return: Dictionary
+        """
+        return self.blocks.find_one({'height': self._length},
+                                    {'_id': 0, 'height': 1, 'block_reward': 1, 'difficulty_bits': 1, 'difficulty': 1})
+
+    def _get_tip_block(self):
+        """
+        Retorne o último bloco completo, buscando-o no banco de dados apenas na primeira vez.
+        :return: Dictionary
+        """
+        if self._last_block is None and self._length > 0:
+            self._last_block = self.blocks.find_one({'height': self._length}, {'_id': 0})
+        return self._last_block
+
+    def _get_tip_digest(self):
+        """
+        Retorne o digest bruto (32 bytes) do último bloco, calculado uma única vez por bloco.
+        Ele é o prefixo da Prova de Trabalho e, em hex, o previous_hash do próximo bloco.
+        :return: Bytes como valor de hash
+        """
+        if self._last_digest is None:
+            self._last_digest = self._digest_json_object(self._get_tip_block())
+        return self._last_digest
+
     def reset(self):
         """
         Apaga o banco de dados e comece tudo de novo criando o bloco genesis.
         """
+        self._pending_blocks = []
+        self.close()
         self.db.blocks.drop()
+        self.create_indexes()
+        self._length = 0
+        self._last_header = None
+        self._last_block = None
+        self._last_digest = None
         self.generate_genesis_block()
 
     def generate_genesis_block(self):
@@ -61,33 +430,70 @@ class IoTBlockchainDB(object):
         :param previous_hash: Hash do bloco anterior
         :return: Novo bloco
         """
+        # Usa o cabeçalho do último bloco e o comprimento mantidos em memória
+        last_header = self._last_header
+        length = self._length
+
         # Define um bloco
         block = {
-            "previous_block": self.get_length(),
-            'height': self.get_length() + 1,
+            "previous_block": length,
+            'height': length + 1,
             'timestamp': ctime(time()),
-            'transactions': self.transactions,
-            "merkle_root": self.find_merkle_root(self.get_transaction_ids()),
-            'number_of_transaction': len(self.transactions),
+            'transactions': self._tx_entries,
+            "merkle_root": self.find_merkle_root(self._tx_ids),
+            'number_of_transaction': len(self._tx_entries),
             'nonce': nonce,
-            'previous_hash': previous_hash or self.hash_json_object(self.get_last_block()),
-            'block_reward': self.calculate_block_reward(),
-            'difficulty_bits': self.calculate_difficulty_bits(),
-            'difficulty': self.calculate_difficulty(),
+            'previous_hash': previous_hash or self._get_tip_digest().hex(),
+            'block_reward': self.calculate_block_reward(last_header),
+            'difficulty_bits': self.calculate_difficulty_bits(last_header),
+            'difficulty': self.calculate_difficulty(last_header),
             'elapsed_time': self.elapsed_time,
             'hash_power': self.hash_power
         }
 
         # Redefine a lista atual de transações
-        self.transactions = []
+        self._reset_transactions()
 
-        # Inserindo no banco de dados
-        self.blocks.insert_one(block)
+        # Atualiza o cache antes da gravação, que acrescenta o '_id' ao bloco
+        self._last_block = dict(block)
+        self._last_header = {field: block[field] for field in ('height', 'block_reward', 'difficulty_bits', 'difficulty')}
+        self._last_digest = None
+        self._length += 1
+
+        # Inserindo no banco de dados, em lote quando BatchSize > 1
+        self._pending_blocks.append(block)
+        self.flush()
 
         print('Bloco #{0} adicionado ao blockchain'.format(block['height']))
 
         return block
 
+    def flush(self, force=False):
+        """
+        Grave no banco de dados os blocos pendentes.
+        :param force: Grava mesmo que o lote ainda não tenha BatchSize blocos
+        """
+        if self._pending_blocks and (force or len(self._pending_blocks) >= self.batch_size):
+            try:
+                self._bulk_blocks.insert_many(self._pending_blocks, ordered=False)
+            except Exception:
+                # O lote falhou, talvez só em parte: descarta os blocos pendentes e recarrega
+                # a ponta da cadeia do banco, para que o cache não fique à frente dele
+                self._pending_blocks = []
+                self._load_chain_tip()
+                raise
+            self._pending_blocks = []
+
+    def close(self):
+        """
+        Grave os blocos pendentes e encerre os processos do pool da árvore de Merkle,
+        se ele tiver sido criado.
+        """
+        self.flush(force=True)
+        if self._merkle_pool is not None:
+            self._merkle_pool.shutdown()
+            self._merkle_pool = None
+
     def add_transaction(self, sender, recipient, amount):
         """
         Adicione uma nova transação ao bloco.
@@ -103,63 +509,156 @@ class IoTBlockchainDB(object):
         }
 
         # Obtém o id da transação fazendo hash de seu conteúdo
-        transaction_id = self.hash_json_object(transaction_info)
+        transaction_id = self._digest_transaction(sender, recipient, amount)
 
-        # Anexar à lista de transações
-        self.transactions.append({
-            'transaction_id': transaction_id,
+        # Anexar à lista de transações: o digest vai para o buffer da árvore de Merkle e
+        # a entrada já no formato do bloco, para que gerar o bloco não percorra as transações
+        self._tx_ids += transaction_id
+        self._tx_entries.append({
+            'transaction_id': transaction_id.hex(),
             'transaction_info': transaction_info
         })
 
+    def _reset_transactions(self):
+        """
+        Esvazie as transações pendentes.
+        Os ids (32 bytes cada) ficam num buffer contíguo usado pela árvore de Merkle,
+        separados das entradas no formato gravado no bloco.
+        """
+        self._tx_ids = bytearray()
+        self._tx_entries = []
+
+    @property
+    def transactions(self):
+        """
+        Transações pendentes no formato gravado no bloco, com o id em hex.
+        :return: Cópia da lista de transações
+        """
+        return list(self._tx_entries)
+
+    @transactions.setter
+    def transactions(self, transactions):
+        """
+        Substitua as transações pendentes, reconstruindo o buffer de ids da árvore de Merkle.
+        :param transactions: Lista de transações no formato gravado no bloco
+        """
+        self._tx_entries = list(transactions)
+        self._tx_ids = bytearray().join(bytes.fromhex(transaction['transaction_id'])
+                                        for transaction in self._tx_entries)
+
     def find_merkle_root(self, transaction_ids):
         """
         Encontre uma raiz merle para uma determinada lista de transações.
-        :param transaction_ids: Lista de transações
+        :param transaction_ids: Buffer contíguo ou lista de ids de transações (digests de 32 bytes)
         :retorno: valor de hash
         """
         # Exceção: se não houver ids de transação, retorne Nenhum
         if len(transaction_ids) == 0:
             return None
 
-        # Caso base: se houver apenas 1 transação, retorne o hash dessa transação
-        if len(transaction_ids) == 1:
-            return transaction_ids[0]
-
-        # Caso contrário, crie uma nova lista de hash
-        new_list = []
-
-        # Passe pela lista de transaction_ids, junte os pares de itens e adicione-os à nova lista
-        for i in range(0, len(transaction_ids) - 1, 2):
-            new_list.append(self.hash_string_pair(transaction_ids[i], transaction_ids[i + 1]))
-
-        # Se o comprimento do transaction_ids for ímpar, o que significa que resta apenas um,
-        # hash a última transação consigo mesma.
-        if len(transaction_ids) % 2 == 1:
-            new_list.append(self.hash_string_pair(transaction_ids[-1], transaction_ids[-1]))
-
-        # Recursivamente faça tudo de novo até sobrar um
-        return self.find_merkle_root(new_list)
+        # Os ids ficam num buffer contíguo de 32 bytes por nó
+        if isinstance(transaction_ids, (list, tuple)):
+            level = bytearray().join(transaction_ids)
+        else:
+            level = memoryview(transaction_ids)
+        n = len(level) // 32
+
+        # Os níveis mais largos vão para o kernel compilado, se houver Numba e CompiledMerkle ou
+        # a árvore pagar a compilação; senão são divididos entre processos. Os estreitos seguem
+        # em série, onde o custo de distribuir o trabalho superaria o ganho.
+        # Os dois caminhos implementam SHA-256: com BLAKE3 a árvore inteira segue pela pilha abaixo
+        use_kernel = njit is not None and (self.compiled_merkle or n >= merkle_kernel_min_leaves)
+        use_pool = (os.cpu_count() or 1) > 1
+        while n >= merkle_parallel_min_leaves and self._node_hash is _sha256 and (use_kernel or use_pool):
+            # Se o comprimento do nível for ímpar, hash a última transação consigo mesma
+            if n & 1:
+                level = bytearray(level) + level[-32:]
+            if use_kernel:
+                level = self.hash_merkle_level_compiled(level)
+            else:
+                level = self.hash_merkle_level_parallel(level)
+            n = len(level) // 32
+
+        # O restante da árvore é percorrido folha a folha com uma pilha de (nível, digest):
+        # dois nós do mesmo nível são combinados assim que aparecem, então só ficam
+        # em memória no máximo log2(n) digests intermediários
+        view = memoryview(level)
+        hash_pair = self.hash_pair
+        stack = []
+        for offset in range(0, n * 32, 32):
+            node_level, digest = 0, view[offset:offset + 32]
+            while stack and stack[-1][0] == node_level:
+                digest = hash_pair(stack.pop()[1], digest)
+                node_level += 1
+            stack.append((node_level, digest))
+
+        # Fecha a árvore: um nó sem irmão no seu nível é combinado consigo mesmo,
+        # como a última transação de um nível ímpar
+        node_level, digest = stack.pop()
+        while stack:
+            sibling = stack.pop()[1] if stack[-1][0] == node_level else digest
+            digest = hash_pair(sibling, digest)
+            node_level += 1
+
+        # Só a raiz final é convertida para hex
+        return digest.hex()
+
+    def hash_merkle_level_compiled(self, level):
+        """
+        Faça o hash dos pares de um nível da árvore de Merkle com o kernel Numba especializado
+        em entradas de 64 bytes, que processa vários pares por vez em cada núcleo.
+        :param level: Buffer com um número par de digests de 32 bytes
+        :return: Bytearray com os digests do próximo nível
+        """
+        # Um buffer somente leitura (bytes) geraria outra especialização do kernel,
+        # com nova compilação; copiado, toda entrada usa a mesma
+        if memoryview(level).readonly:
+            level = bytearray(level)
+        next_level = bytearray(len(level) // 2)
+        _hash_merkle_pairs_d64(np.frombuffer(level, dtype=np.uint8), np.frombuffer(next_level, dtype=np.uint8))
+        return next_level
+
+    def hash_merkle_level_parallel(self, level):
+        """
+        Faça o hash dos pares de um nível da árvore de Merkle em paralelo, mantendo a ordem.
+        O hashlib não libera a GIL para entradas de 64 bytes, então o trabalho vai para processos.
+        :param level: Buffer com um número par de digests de 32 bytes
+        :return: Bytearray com os digests do próximo nível
+        """
+        # Processos iniciados com 'spawn': um fork depois das threads de um kernel Numba pode travar.
+        # Por isso o script que usa o pool precisa estar protegido por if __name__ == '__main__'
+        if self._merkle_pool is None:
+            self._merkle_pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                                    mp_context=multiprocessing.get_context('spawn'))
+
+        # Divide o nível em trechos contíguos alinhados a pares (64 bytes), copiados para bytes:
+        # o nível pode chegar como memoryview, que não é serializável para os processos
+        n_pairs = len(level) // 64
+        chunk_size = -(-n_pairs // os.cpu_count()) * 64
+        chunks = [bytes(level[i:i + chunk_size]) for i in range(0, len(level), chunk_size)]
+
+        return bytearray().join(self._merkle_pool.map(_hash_merkle_pairs, chunks))
 
     def mine_for_next_block(self):
         """
         Encontre o nonce para o próximo bloco e adicione-o à cadeia.
         """
+        # Pegue o cabeçalho do último bloco
+        last_header = self._last_header
+
         # Suponha que o endereço do remetente e do destinatário seja fixo ao minerar um bloco
         reward = {
             'sender': '00000000000000000000x0',
             'recipient': '00000000000000000000x1',
-            'amount': self.calculate_block_reward()
+            'amount': self.calculate_block_reward(last_header)
         }
-
-        # Pegue o último bloco
-        last_block = self.get_last_block()
-        last_difficulty_bits = last_block['difficulty_bits']
+        last_difficulty_bits = last_header['difficulty_bits']
 
         # Defina o temporizador para calcular o tempo que leva para minerar um bloco
         start_time = time()
 
         # Encontre nonce para o próximo bloco, dado o último bloco e o nível de dificuldade
-        next_nonce = self.calculate_nonce(last_block, last_difficulty_bits)
+        next_nonce = self._find_nonce(self._get_tip_digest(), last_difficulty_bits)
 
         # Checkpoint quanto tempo demorou para encontrar um resultado
         end_time = time()
@@ -183,54 +682,132 @@ class IoTBlockchainDB(object):
         :param number_of_bits: Número de bits de dificuldade
         :return: Int se for bem sucedido, Nenhum se falhar
         """
-        # Calcular a dificuldade alvo
+        # O último bloco entra no hash pelo seu digest canônico (JSON ordenado, 32 bytes),
+        # assim cada tentativa processa só 36 bytes, um único bloco de compressão
+        return self._find_nonce(self._digest_json_object(last_block), number_of_bits)
+
+    def _find_nonce(self, prefix, number_of_bits):
+        """
+        Procure o primeiro nonce tal que SHA-256(prefix + nonce) fique abaixo do alvo.
+        :param prefix: Digest do último bloco
+        :param number_of_bits: Número de bits de dificuldade
+        :return: Int se for bem sucedido, Nenhum se falhar
+        """
+        # Sem bits de dificuldade qualquer hash fica abaixo do alvo (2 ** 256)
+        if number_of_bits <= 0:
+            return 0
+
+        # Calcular a dificuldade alvo como 32 bytes big-endian,
+        # comparável diretamente com o digest
         target = 2 ** (256 - number_of_bits)
+        target_bytes = target.to_bytes(32, 'big')
+
+        # Para dificuldades maiores usa o kernel compilado, que roda fora da GIL em todos os núcleos
+        if njit is not None and number_of_bits >= pow_kernel_min_bits and get_num_threads() > 1:
+            return self.calculate_nonce_compiled(prefix, number_of_bits)
+
+        # O prefixo é absorvido uma única vez, fora do laço.
+        # A cada tentativa copia-se esse estado intermediário (midstate) e
+        # só os bytes do nonce são processados
+        copy_midstate = _sha256(prefix).copy
+        pack_nonce = struct.Struct('<I').pack
 
         # Aumente constantemente o nonce em 1 e adivinhe o nonce certo
         for nonce in range(max_nonce):
-            string = (str(last_block) + str(nonce)).encode()
-            hash_result = hashlib.sha256(string).hexdigest()
+            hash_result = copy_midstate()
+            hash_result.update(pack_nonce(nonce))
 
             # Check if the hash result is below the target
-            if int(hash_result, 16) < target:
+            if hash_result.digest() < target_bytes:
                 return nonce
 
         return None
 
+    def calculate_nonce_compiled(self, prefix, number_of_bits):
+        """
+        Calcule o nonce com o kernel Numba, testando prefix + nonce (4 bytes little-endian).
+        :param prefix: Digest do último bloco
+        :param number_of_bits: Número de bits de dificuldade
+        :return: Int se for bem sucedido, Nenhum se falhar
+        """
+        # Calcula o midstate absorvendo os blocos completos de 64 bytes do prefixo
+        data = np.frombuffer(prefix, dtype=np.uint8)
+        n_full = len(prefix) // 64 * 64
+        midstate = _SHA256_IV.copy()
+        w = np.empty(64, np.int64)
+        for offset in range(0, n_full, 64):
+            _sha256_compress(midstate, data[offset:offset + 64], w)
+        tail = data[n_full:].copy()
+
+        # O alvo é reduzido uma única vez, para toda a mineração, a palavras inteiras
+        # que precisam ser zero e uma máscara para os bits restantes
+        zero_words, remaining_bits = divmod(number_of_bits, 32)
+        mask = (0xFFFFFFFF << (32 - remaining_bits)) & 0xFFFFFFFF if remaining_bits else 0
+
+        # Percorre o espaço de nonces em janelas, para parar cedo quando achar um resultado
+        n_slices = get_num_threads()
+        window = n_slices * pow_kernel_slice
+        for start in range(0, max_nonce, window):
+            end = min(start + window, max_nonce)
+            nonce = _pow_search(midstate, tail, len(prefix), zero_words, mask, start, end, n_slices)
+            if nonce >= 0:
+                return int(nonce)
+
+        return None
+
     def hash_json_object(self, json_object):
         """
         Crie um hash SHA-256 de um objeto JSON.
         :param json_object: objeto JSON
         :return: String como valor de hash
         """
-        # Certifique-se de que os dados estejam ordenados, caso contrário, teria hashes inconsistentes
-        json_string = json.dumps(json_object, sort_keys=True).encode()
-        hash_string = hashlib.sha256(json_string).hexdigest()
-        return hash_string
+        return self._digest_json_object(json_object).hex()
 
-    def hash_string_pair(self, string_1, string_2):
+    def _digest_json_object(self, json_object):
         """
-        Retorna um valor de hash para um determinado par de strings.
-        :param string_1: String
-        :param string_2: String
-        :return: String como valor de hash
+        Crie o digest SHA-256 bruto (32 bytes) de um objeto JSON.
+        :param json_object: objeto JSON
+        :return: Bytes como valor de hash
         """
-        # Concatenar 2 strings e codificá-las
-        temp_string = (string_1 + string_2).encode()
+        # Certifique-se de que os dados estejam ordenados, caso contrário, teria hashes inconsistentes.
+        # Tipos que não são JSON (datas, ObjectId) entram pela sua representação em texto
+        json_string = json.dumps(json_object, sort_keys=True, default=str).encode()
+        return _sha256(json_string).digest()
 
-        # Obtém o valor do hash
-        hash_string = hashlib.sha256(temp_string).hexdigest()
-        return hash_string
+    def _digest_transaction(self, sender, recipient, amount):
+        """
+        Crie o digest bruto (32 bytes) de uma transação, com o algoritmo de HashAlgorithm.
+        Os campos são sempre os mesmos, então a forma canônica é montada diretamente,
+        sem serializar e ordenar um JSON a cada transação.
+        :param sender: Endereço do remetente
+        :param recipient: Endereço do destinatário
+        :param amount: Quantidade de tokens
+        :return: Bytes como valor de hash
+        """
+        # Os campos vão numa lista JSON, em ordem fixa: cada valor é serializado pelo que é,
+        # não pelo tipo (np.float64(1.5) vira 1.5, como o float), e as strings ficam entre aspas,
+        # então não há ambiguidade entre campos
+        return self._node_hash(json.dumps([sender, recipient, amount], default=str).encode()).digest()
 
-    def calculate_block_reward(self):
+    def hash_pair(self, digest_1, digest_2):
+        """
+        Retorna o digest de um par de nós da árvore de Merkle.
+        :param digest_1: Bytes (32)
+        :param digest_2: Bytes (32)
+        :return: Bytes como valor de hash
+        """
+        # Duas chamadas a update() evitam alocar a concatenação dos digests
+        hash_result = self._node_hash(digest_1)
+        hash_result.update(digest_2)
+        return hash_result.digest()
+
+    def calculate_block_reward(self, last_block):
         """
         Calcule a recompensa do bloco para o próximo bloco minerado.
         Reduza a recompensa pela metade para cada n blocos, até que eventualmente reduza para 0.
+        :param last_block: Último bloco
         :return: Int
         """
-        # Pegue o último bloco
-        last_block = self.get_last_block()
-
         # Se ainda não temos nenhum bloco, significa que estamos criando o bloco gênese
         # Retorna o init_reward = 50
         if last_block == None:
@@ -251,15 +828,13 @@ class IoTBlockchainDB(object):
         else:
             return current_reward
 
-    def calculate_difficulty_bits(self):
+    def calculate_difficulty_bits(self, last_block):
         """
         Calcule os bits de dificuldade para o próximo bloco minerado.
         Para cada n blocos, aumente os bits de dificuldade em 1.
+        :param last_block: Último bloco
         :return: Int
         """
-        # Pegue o último bloco
-        last_block = self.get_last_block()
-
         # Se ainda não temos nenhum bloco, significa que estamos criando o bloco gênese
         # Defina os bits de dificuldade para 0
         if last_block == None:
@@ -277,16 +852,14 @@ class IoTBlockchainDB(object):
         else:
             return current_difficulty_bits
 
-    def calculate_difficulty(self):
+    def calculate_difficulty(self, last_block):
         """
         Calculate the difficulty for the next mined block.
         For every n blocks, since the difficulty bits is increased by 1,
         the difficulty will increase exponentially by the number of 2.
+        :param last_block: Last block
         :return: Int
         """
-        # Get the last block
-        last_block = self.get_last_block()
-
         # If we don't have any block yet, it means that we are creating the genesis block
         # Set the difficulty to 1
         if last_block == None:
@@ -309,9 +882,15 @@ class IoTBlockchainDB(object):
     def get_length(self):
         """
         Get the length of BlockChain.
+        Uses the height index instead of counting every document.
         :return: Int
         """
-        return self.blocks.count_documents({})
+        # Blocks waiting to be written are always the newest ones
+        if self._pending_blocks:
+            return self._length
+
+        block = self.blocks.find_one({}, {'height': 1, '_id': 0}, sort=[('height', -1)])
+        return 0 if block is None else block['height']
 
     def get_last_n_blocks(self, number):
         """
@@ -319,6 +898,7 @@ class IoTBlockchainDB(object):
         :param number: Number of blocks
         :return: Dictionary as a list of blocks
         """
+        self.flush(force=True)
         return self.blocks.find({}, {'_id': 0}).sort([('height', -1)]).limit(number)
 
     def get_top_blocks(self, state, number):
@@ -326,6 +906,7 @@ class IoTBlockchainDB(object):
         Get a number of top blocks for a given state.
         :return: List of blocks in dictionary format
         """
+        self.flush(force=True)
         if state == 'difficulty':
             return self.blocks.find({}, {'_id': 0}).sort([('difficulty', -1)]).limit(number)
         elif state == 'elapsed_time':
@@ -348,6 +929,9 @@ class IoTBlockchainDB(object):
         Get last block of the chain.
         :return: Dictionary
         """
+        if self._pending_blocks:
+            return dict(self._last_block)
+
         return self.blocks.find_one({'height': self.get_length()}, {'_id': 0})
 
     def get_genesis_block(self):
@@ -355,13 +939,20 @@ class IoTBlockchainDB(object):
         Get first block of the chain.
         :return: Dictionary
         """
-        return self.blocks.find_one({'height': 1}, {'_id': 0})
+        return self.get_block(1)
 
     def get_block(self, height):
         """
         Get a block given height number.
         :return: Dictionary
         """
+        # Pending blocks have consecutive heights, starting right after the last written one
+        if self._pending_blocks and height >= self._pending_blocks[0]['height']:
+            index = height - self._pending_blocks[0]['height']
+            if index < len(self._pending_blocks):
+                return {key: value for key, value in self._pending_blocks[index].items() if key != '_id'}
+            return None
+
         return self.blocks.find_one({'height': height}, {'_id': 0})
 
     def get_all_blocks(self):
@@ -369,16 +960,13 @@ class IoTBlockchainDB(object):
         Get the full BlockChain.
         :return: List of blocks in dictionary
         """
+        self.flush(force=True)
         all_blocks = self.blocks.find({}, {'_id': 0})
         return all_blocks
 
     def get_transaction_ids(self):
         """
-        Get a list of transaction ids.
-        :return: List of transaction ids.
+        Get the ids of the pending transactions.
+        :return: Copy of the contiguous 32-byte digests, one per transaction.
         """
-        transaction_ids = []
-        for transaction in self.transactions:
-            transaction_id = transaction['transaction_id']
-            transaction_ids.append(transaction_id)
-        return transaction_ids
+        return bytes(self._tx_ids)